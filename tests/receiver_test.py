@@ -18,16 +18,13 @@ Usage:
 """
 
 import argparse
-import json
+import asyncio
 import os
 import sys
 import time
-import urllib.request
-import urllib.error
 import uuid
-from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
 
 # Load .env.local from repo root
@@ -51,6 +48,8 @@ EPHEMERAL_REQUEST_LIMIT = 25
 
 RECEIVER_URL = "http://localhost:3001"
 HTTP_CONCURRENCY = 200
+SEED_SHARDS = 4  # parallel seeding workers, each with its own DB connection
+PROGRESS_INTERVAL_SECS = 2.0
 
 # Postgres connection (uses env var or default)
 DB_URL = os.environ.get("SUPABASE_DB_URL", "")
@@ -73,9 +72,37 @@ except ImportError:
     print("ERROR: psycopg2 required. Install with: pip install psycopg2-binary")
     sys.exit(1)
 
+try:
+    import orjson
+except ImportError:
+    print("ERROR: orjson required. Install with: pip install orjson")
+    sys.exit(1)
+
+try:
+    import numpy as np
+except ImportError:
+    print("ERROR: numpy required. Install with: pip install numpy")
+    sys.exit(1)
+
+try:
+    import httpx
+except ImportError:
+    print("ERROR: httpx required. Install with: pip install httpx")
+    sys.exit(1)
+
+
+_conn = None
+
 
 def get_conn():
-    return psycopg2.connect(DB_URL)
+    """Return the shared connection, opening it on first use.
+
+    `with conn:` only ends the transaction, so every helper reuses one socket.
+    """
+    global _conn
+    if _conn is None or _conn.closed:
+        _conn = psycopg2.connect(DB_URL)
+    return _conn
 
 
 def db_exec(sql, params=None):
@@ -100,42 +127,48 @@ def db_scalar(sql, params=None):
             return row[0] if row else None
 
 
+# Keep-alive client for the synchronous paths: the functional phases, the
+# Supabase admin calls and the seed threads. The load test has its own
+# AsyncClient, so this only needs a connection per seed thread.
+CLIENT = httpx.Client(
+    limits=httpx.Limits(max_connections=SEED_SHARDS, max_keepalive_connections=SEED_SHARDS),
+    timeout=10.0,
+    headers={"Content-Type": "application/json"},
+)
+
+
+SUPABASE_ADMIN_HEADERS = {
+    "Content-Type": "application/json",
+    "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
+    "apikey": SUPABASE_SERVICE_ROLE_KEY,
+}
+
+
 def supabase_create_auth_user(email: str, password: str = "TestPassword123!") -> str:
     """Create a user via Supabase Auth admin API. Returns user ID."""
-    data = json.dumps({
+    data = orjson.dumps({
         "email": email,
         "password": password,
         "email_confirm": True,
         "user_metadata": {"full_name": "Receiver Test User"},
-    }).encode()
-    req = urllib.request.Request(
+    })
+    resp = CLIENT.post(
         f"{SUPABASE_URL}/auth/v1/admin/users",
-        data=data,
-        method="POST",
-        headers={
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
-            "apikey": SUPABASE_SERVICE_ROLE_KEY,
-        },
+        content=data,
+        headers=SUPABASE_ADMIN_HEADERS,
     )
-    with urllib.request.urlopen(req, timeout=10) as resp:
-        body = json.loads(resp.read())
-        return body["id"]
+    if resp.status_code >= 400:
+        raise RuntimeError(f"Supabase user creation failed ({resp.status_code}): {resp.content[:200]!r}")
+    return orjson.loads(resp.content)["id"]
 
 
 def supabase_delete_auth_user(user_id: str):
     """Delete a user via Supabase Auth admin API."""
-    req = urllib.request.Request(
-        f"{SUPABASE_URL}/auth/v1/admin/users/{user_id}",
-        method="DELETE",
-        headers={
-            "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
-            "apikey": SUPABASE_SERVICE_ROLE_KEY,
-        },
-    )
     try:
-        with urllib.request.urlopen(req, timeout=10):
-            pass
+        CLIENT.delete(
+            f"{SUPABASE_URL}/auth/v1/admin/users/{user_id}",
+            headers=SUPABASE_ADMIN_HEADERS,
+        )
     except Exception:
         pass
 
@@ -149,30 +182,30 @@ class EndpointResult:
     ok_count: int = 0
     rejected_count: int = 0
     error_count: int = 0
-    latencies_ms: list = field(default_factory=list)
 
 
-def send_request(url: str, body: bytes | None = None) -> tuple[int, float]:
-    data = body or b'{"event":"test","ts":' + str(int(time.time() * 1000)).encode() + b'}'
-    req = urllib.request.Request(url, data=data, method="POST")
-    req.add_header("Content-Type", "application/json")
+# The receiver stores bodies verbatim without inspecting them, so every
+# request can share one immutable buffer.
+TEST_BODY = b'{"event":"test"}'
+
+
+def send_request(url: str, body: bytes | None = None) -> tuple[int, float, bytes]:
+    data = body or TEST_BODY
     start = time.monotonic()
     try:
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            resp_body = resp.read()
-            return resp.status, (time.monotonic() - start) * 1000, resp_body
-    except urllib.error.HTTPError as e:
-        body_bytes = e.read() if e.fp else b""
-        return e.code, (time.monotonic() - start) * 1000, body_bytes
+        resp = CLIENT.post(url, content=data)
+        return resp.status_code, (time.monotonic() - start) * 1000, resp.content
     except Exception:
         return 0, (time.monotonic() - start) * 1000, b""
 
 
-def percentile(sorted_list, p):
-    if not sorted_list:
-        return 0
-    idx = int(len(sorted_list) * p / 100)
-    return sorted_list[min(idx, len(sorted_list) - 1)]
+def percentiles(values, ps):
+    """Nearest-rank percentiles via one O(n) partition instead of a full sort."""
+    if len(values) == 0:
+        return [0] * len(ps)
+    idx = [min(int(len(values) * p / 100), len(values) - 1) for p in ps]
+    part = np.partition(values, idx)
+    return [part[i] for i in idx]
 
 
 # ─── Phases ──────────────────────────────────────────────────────────────────
@@ -180,6 +213,45 @@ def percentile(sorted_list, p):
 TEST_PREFIX = "rcv_test_"
 
 
+def seed_shard(user_indices):
+    """Create one shard's auth users, then write its rows on a dedicated connection."""
+    users = []
+    for i in user_indices:
+        email = f"{TEST_PREFIX}{i}_{int(time.time())}@test.local"
+        user_id = supabase_create_auth_user(email)
+        slugs = [f"{TEST_PREFIX}{i}_{j}_{int(time.time())}" for j in range(ENDPOINTS_PER_USER)]
+        users.append({"userId": user_id, "email": email, "slugs": slugs, "idx": i})
+
+    # The shared get_conn() connection can't run concurrent statements
+    conn = psycopg2.connect(DB_URL)
+    try:
+        with conn.cursor() as cur:
+            # The handle_new_user trigger creates the public.users row;
+            # update it with test-specific settings
+            cur.execute("""
+                UPDATE public.users
+                SET plan = 'pro', request_limit = %s, requests_used = 0,
+                    period_start = now(), period_end = now() + interval '1 hour'
+                WHERE id = ANY(%s::uuid[])
+            """, (REQUEST_LIMIT_PER_USER, [u["userId"] for u in users]))
+
+            # One page for all rows, so the statement is sent and parsed once
+            # rather than once per 100-row default page.
+            endpoint_rows = [(slug, u["userId"]) for u in users for slug in u["slugs"]]
+            psycopg2.extras.execute_values(cur, """
+                INSERT INTO public.endpoints (slug, user_id, is_ephemeral, expires_at)
+                VALUES %s
+                ON CONFLICT (slug) DO NOTHING
+            """, endpoint_rows,
+                template="(%s, %s, false, now() + interval '1 hour')",
+                page_size=max(len(endpoint_rows), 1))
+        conn.commit()
+    finally:
+        conn.close()
+
+    return users
+
+
 def phase_seed():
     """Create test users and endpoints in Postgres."""
     print("\n" + "=" * 70)
@@ -189,32 +261,13 @@ def phase_seed():
     print(f"  Request limit per user: {REQUEST_LIMIT_PER_USER}")
 
     start = time.monotonic()
-    users = []
 
-    for i in range(USER_COUNT):
-        email = f"{TEST_PREFIX}{i}_{int(time.time())}@test.local"
-        user_id = supabase_create_auth_user(email)
+    shards = [range(k, USER_COUNT, SEED_SHARDS) for k in range(SEED_SHARDS)]
+    with ThreadPoolExecutor(max_workers=SEED_SHARDS) as executor:
+        shard_users = list(executor.map(seed_shard, shards))
 
-        # The handle_new_user trigger creates the public.users row;
-        # update it with test-specific settings
-        db_exec("""
-            UPDATE public.users
-            SET plan = 'pro', request_limit = %s, requests_used = 0,
-                period_start = now(), period_end = now() + interval '1 hour'
-            WHERE id = %s
-        """, (REQUEST_LIMIT_PER_USER, user_id))
-
-        slugs = []
-        for j in range(ENDPOINTS_PER_USER):
-            slug = f"{TEST_PREFIX}{i}_{j}_{int(time.time())}"
-            db_exec("""
-                INSERT INTO public.endpoints (slug, user_id, is_ephemeral, expires_at)
-                VALUES (%s, %s, false, now() + interval '1 hour')
-                ON CONFLICT (slug) DO NOTHING
-            """, (slug, user_id))
-            slugs.append(slug)
-
-        users.append({"userId": user_id, "email": email, "slugs": slugs, "idx": i})
+    # Later phases index arrays by user idx, so restore idx order
+    users = sorted((u for shard in shard_users for u in shard), key=lambda u: u["idx"])
 
     elapsed = time.monotonic() - start
     total_eps = sum(len(u["slugs"]) for u in users)
@@ -222,6 +275,57 @@ def phase_seed():
     return users
 
 
+async def fire_load(urls, order, latencies, statuses, start):
+    """Drive the load test from one event loop over a shared keep-alive client.
+
+    The receiver is served over HTTP/1.1 only (axum without the http2
+    feature), so connections are pooled but not multiplexed. A fixed set of
+    HTTP_CONCURRENCY workers walk `order`, a permutation of the slug-major
+    request slots: slot k belongs to urls[k // REQUESTS_PER_ENDPOINT], and
+    its latency and status land at index k of the preallocated arrays.
+    """
+    limits = httpx.Limits(
+        max_connections=HTTP_CONCURRENCY,
+        max_keepalive_connections=HTTP_CONCURRENCY,
+    )
+    total_requests = len(order)
+    next_idx = 0
+    completed = 0
+    last_report = start
+
+    async with httpx.AsyncClient(
+        http2=False,
+        limits=limits,
+        timeout=10.0,
+        headers={"Content-Type": "application/json"},
+    ) as client:
+
+        async def worker():
+            nonlocal next_idx, completed, last_report
+            while next_idx < total_requests:
+                slot = order[next_idx]
+                next_idx += 1
+
+                req_start = time.monotonic()
+                try:
+                    resp = await client.post(urls[slot // REQUESTS_PER_ENDPOINT], content=TEST_BODY)
+                    status = resp.status_code
+                except Exception:
+                    # Count as an error rather than aborting the run (and cleanup)
+                    status = 0
+                now = time.monotonic()
+                latencies[slot] = (now - req_start) * 1000
+                statuses[slot] = status
+
+                # Time-gated so progress output doesn't scale with RPS
+                completed += 1
+                if now - last_report >= PROGRESS_INTERVAL_SECS:
+                    last_report = now
+                    print(f"  Progress: {completed}/{total_requests} ({completed/(now - start):.0f} RPS)")
+
+        await asyncio.gather(*(worker() for _ in range(HTTP_CONCURRENCY)))
+
+
 def phase_load_test(users):
     """Fire requests at all endpoints and measure throughput + quota."""
     print("\n" + "=" * 70)
@@ -241,49 +345,36 @@ def phase_load_test(users):
     print(f"  Concurrency: {HTTP_CONCURRENCY}")
     print()
 
-    work_items = []
-    for slug in all_slugs:
-        for _ in range(REQUESTS_PER_ENDPOINT):
-            work_items.append(slug)
-
-    import random
-    random.shuffle(work_items)
+    # Random interleaving of exactly REQUESTS_PER_ENDPOINT requests per slug
+    order = np.random.permutation(total_requests).astype(np.int32)
+    urls = [f"{RECEIVER_URL}/w/{slug}/load-test" for slug in all_slugs]
 
-    results_by_slug = {slug: EndpointResult(slug=slug, user_idx=slug_map[slug]["userIdx"]) for slug in all_slugs}
+    latencies = np.empty(total_requests, dtype=np.float32)
+    statuses = np.empty(total_requests, dtype=np.int16)
 
     start = time.monotonic()
-    completed = 0
-
-    with ThreadPoolExecutor(max_workers=HTTP_CONCURRENCY) as executor:
-        futures = {}
-        for slug in work_items:
-            url = f"{RECEIVER_URL}/w/{slug}/load-test"
-            f = executor.submit(send_request, url)
-            futures[f] = slug
-
-        for future in as_completed(futures):
-            slug = futures[future]
-            status, latency_ms, _ = future.result()
-            r = results_by_slug[slug]
-            r.latencies_ms.append(latency_ms)
-
-            if status == 200:
-                r.ok_count += 1
-            elif status == 429:
-                r.rejected_count += 1
-            else:
-                r.error_count += 1
-
-            completed += 1
-            if completed % 500 == 0:
-                elapsed = time.monotonic() - start
-                print(f"  Progress: {completed}/{total_requests} ({completed/elapsed:.0f} RPS)")
+    asyncio.run(fire_load(urls, order, latencies, statuses, start))
 
     elapsed = time.monotonic() - start
-    all_latencies = sorted(lat for r in results_by_slug.values() for lat in r.latencies_ms)
-    total_ok = sum(r.ok_count for r in results_by_slug.values())
-    total_429 = sum(r.rejected_count for r in results_by_slug.values())
-    total_err = sum(r.error_count for r in results_by_slug.values())
+
+    # Results are stored slug-major, so each row holds one endpoint's requests
+    by_slug = statuses.reshape(len(all_slugs), REQUESTS_PER_ENDPOINT)
+    ok_counts = (by_slug == 200).sum(axis=1)
+    rejected_counts = (by_slug == 429).sum(axis=1)
+    results_by_slug = {
+        slug: EndpointResult(
+            slug=slug,
+            user_idx=slug_map[slug]["userIdx"],
+            ok_count=int(ok_counts[i]),
+            rejected_count=int(rejected_counts[i]),
+            error_count=int(REQUESTS_PER_ENDPOINT - ok_counts[i] - rejected_counts[i]),
+        )
+        for i, slug in enumerate(all_slugs)
+    }
+
+    total_ok = int(ok_counts.sum())
+    total_429 = int(rejected_counts.sum())
+    total_err = total_requests - total_ok - total_429
 
     print()
     print(f"  Duration:  {elapsed:.1f}s")
@@ -291,12 +382,13 @@ def phase_load_test(users):
     print(f"  OK (200):  {total_ok:,}")
     print(f"  Quota (429): {total_429:,}")
     print(f"  Errors:    {total_err:,}")
-    print(f"  Latency P50:  {percentile(all_latencies, 50):.1f}ms")
-    print(f"  Latency P90:  {percentile(all_latencies, 90):.1f}ms")
-    print(f"  Latency P99:  {percentile(all_latencies, 99):.1f}ms")
-    print(f"  Latency P99.9: {percentile(all_latencies, 99.9):.1f}ms")
+    p50, p90, p99, p999 = percentiles(latencies, [50, 90, 99, 99.9])
+    print(f"  Latency P50:  {p50:.1f}ms")
+    print(f"  Latency P90:  {p90:.1f}ms")
+    print(f"  Latency P99:  {p99:.1f}ms")
+    print(f"  Latency P99.9: {p999:.1f}ms")
 
-    return results_by_slug, slug_map
+    return results_by_slug
 
 
 def phase_quota_check(results_by_slug, users):
@@ -305,29 +397,54 @@ def phase_quota_check(results_by_slug, users):
     print("PHASE 3: Quota enforcement check")
     print("=" * 70)
 
-    user_accepted = defaultdict(int)
+    # Users are seeded with idx == position, so idx addresses these arrays
+    accepted = np.zeros(len(users), dtype=np.int32)
     for r in results_by_slug.values():
-        user_accepted[r.user_idx] += r.ok_count
+        accepted[r.user_idx] += r.ok_count
+    overruns = accepted - REQUEST_LIMIT_PER_USER
+    violators = np.where(overruns > MAX_ACCEPTABLE_OVERRUN)[0]
 
-    violations = []
-    for u in users:
-        accepted = user_accepted[u["idx"]]
-        overrun = accepted - REQUEST_LIMIT_PER_USER
-        if overrun > MAX_ACCEPTABLE_OVERRUN:
-            violations.append((u["idx"], accepted, overrun))
-
-    if violations:
-        print(f"  FAIL: {len(violations)} users exceeded acceptable overrun ({MAX_ACCEPTABLE_OVERRUN})")
-        for idx, accepted, overrun in violations[:10]:
-            print(f"    User {idx}: accepted {accepted} (overrun {overrun})")
+    p50, p90, p99 = percentiles(overruns, [50, 90, 99])
+    print(f"  Overrun P50/P90/P99: {p50:.0f}/{p90:.0f}/{p99:.0f}")
+
+    if len(violators):
+        print(f"  FAIL: {len(violators)} users exceeded acceptable overrun ({MAX_ACCEPTABLE_OVERRUN})")
+        for idx in violators[:10]:
+            print(f"    User {idx}: accepted {accepted[idx]} (overrun {overruns[idx]})")
         return False
     else:
-        max_overrun = max((user_accepted[u["idx"]] - REQUEST_LIMIT_PER_USER) for u in users) if users else 0
+        max_overrun = int(overruns.max()) if len(users) else 0
         print(f"  PASS: All users within tolerance (max overrun: {max_overrun})")
         return True
 
 
-def phase_delivery_check(results_by_slug, slug_map, users):
+def fetch_user_stats(users):
+    """Fetch requests_used and stored load-test request count for every user in one query.
+
+    Returns (used, stored) arrays indexed by user idx.
+    """
+    user_ids = [u["userId"] for u in users]
+    rows = db_query("""
+        SELECT u.id, u.requests_used, count(r.id) AS stored
+        FROM public.users u
+        LEFT JOIN public.requests r
+          ON r.user_id = u.id AND r.path = '/load-test'
+        WHERE u.id = ANY(%s::uuid[])
+        GROUP BY u.id, u.requests_used
+    """, (user_ids,))
+    by_id = {r["id"]: r for r in rows}
+
+    used = np.zeros(len(users), dtype=np.int64)
+    stored = np.zeros(len(users), dtype=np.int64)
+    for u in users:
+        row = by_id.get(u["userId"])
+        if row:
+            used[u["idx"]] = row["requests_used"]
+            stored[u["idx"]] = row["stored"]
+    return used, stored
+
+
+def phase_delivery_check(results_by_slug, user_stats):
     """Verify all accepted requests are stored in Postgres."""
     print("\n" + "=" * 70)
     print("PHASE 4: Delivery accuracy check")
@@ -336,18 +453,8 @@ def phase_delivery_check(results_by_slug, slug_map, users):
     total_accepted = sum(r.ok_count for r in results_by_slug.values())
     print(f"  Expected stored requests: {total_accepted:,}")
 
-    # Count stored requests per user
-    user_ids = [u["userId"] for u in users]
-    rows = db_query("""
-        SELECT user_id, count(*) as cnt
-        FROM public.requests
-        WHERE user_id = ANY(%s::uuid[])
-          AND path = '/load-test'
-        GROUP BY user_id
-    """, (user_ids,))
-
-    stored_by_user = {r["user_id"]: r["cnt"] for r in rows}
-    total_stored = sum(stored_by_user.values())
+    _, stored = user_stats
+    total_stored = int(stored.sum())
 
     print(f"  Actually stored: {total_stored:,}")
 
@@ -364,38 +471,19 @@ def phase_delivery_check(results_by_slug, slug_map, users):
         return False
 
 
-def phase_usage_check(users):
+def phase_usage_check(users, user_stats):
     """Verify requests_used on each user matches stored request count."""
     print("\n" + "=" * 70)
     print("PHASE 5: Usage counter accuracy")
     print("=" * 70)
 
-    user_ids = [u["userId"] for u in users]
-    rows = db_query("""
-        SELECT id, requests_used FROM public.users WHERE id = ANY(%s::uuid[])
-    """, (user_ids,))
-    usage_by_id = {r["id"]: r["requests_used"] for r in rows}
-
-    stored_rows = db_query("""
-        SELECT user_id, count(*) as cnt
-        FROM public.requests
-        WHERE user_id = ANY(%s::uuid[]) AND path = '/load-test'
-        GROUP BY user_id
-    """, (user_ids,))
-    stored_by_id = {r["user_id"]: r["cnt"] for r in stored_rows}
-
-    mismatches = []
-    for u in users:
-        uid = u["userId"]
-        used = usage_by_id.get(uid, 0)
-        stored = stored_by_id.get(uid, 0)
-        if used != stored:
-            mismatches.append((u["idx"], used, stored))
+    used, stored = user_stats
+    mismatches = np.where(used != stored)[0]
 
-    if mismatches:
+    if len(mismatches):
         print(f"  FAIL: {len(mismatches)} users have requests_used != stored count")
-        for idx, used, stored in mismatches[:10]:
-            print(f"    User {idx}: requests_used={used}, stored={stored}")
+        for idx in mismatches[:10]:
+            print(f"    User {idx}: requests_used={used[idx]}, stored={stored[idx]}")
         return False
     else:
         print(f"  PASS: All {len(users)} users have accurate usage counters")
@@ -476,7 +564,7 @@ def phase_mock_response_test():
         UPDATE public.users SET plan = 'pro', request_limit = 100 WHERE id = %s
     """, (user_id,))
 
-    mock = json.dumps({"status": 201, "body": '{"ok":true}', "headers": {"x-custom": "test"}})
+    mock = orjson.dumps({"status": 201, "body": '{"ok":true}', "headers": {"x-custom": "test"}}).decode()
     db_exec("""
         INSERT INTO public.endpoints (slug, user_id, is_ephemeral, mock_response)
         VALUES (%s, %s, false, %s::jsonb)
@@ -551,11 +639,10 @@ def main():
 
     # Health check
     try:
-        req = urllib.request.Request(f"{RECEIVER_URL}/health", method="GET")
-        with urllib.request.urlopen(req, timeout=5) as resp:
-            if resp.status != 200:
-                print(f"\n  ERROR: Receiver health check failed (status {resp.status})")
-                sys.exit(1)
+        resp = CLIENT.get(f"{RECEIVER_URL}/health", timeout=5.0)
+        if resp.status_code != 200:
+            print(f"\n  ERROR: Receiver health check failed (status {resp.status_code})")
+            sys.exit(1)
     except Exception as e:
         print(f"\n  ERROR: Cannot reach receiver at {RECEIVER_URL}: {e}")
         sys.exit(1)
@@ -571,10 +658,11 @@ def main():
 
     # Load test
     users = phase_seed()
-    results_by_slug, slug_map = phase_load_test(users)
+    results_by_slug = phase_load_test(users)
     results.append(("Quota enforcement", phase_quota_check(results_by_slug, users)))
-    results.append(("Delivery accuracy", phase_delivery_check(results_by_slug, slug_map, users)))
-    results.append(("Usage counters", phase_usage_check(users)))
+    user_stats = fetch_user_stats(users)
+    results.append(("Delivery accuracy", phase_delivery_check(results_by_slug, user_stats)))
+    results.append(("Usage counters", phase_usage_check(users, user_stats)))
 
     # Cleanup
     if not args.skip_cleanup: